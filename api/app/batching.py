@@ -0,0 +1,45 @@
+import asyncio
+from .database import db
+
+class Batcher:
+    """Coalesce point reads arriving within `delay` seconds into one `$in` query; each caller gets its doc or None"""
+
+    def __init__(self, collection: str, key_field: str, projection: dict, delay: float = 0.005):
+        self.collection = collection
+        self.key_field = key_field
+        self.projection = projection
+        self.delay = delay
+        self.pending: list[tuple[str, asyncio.Future]] = []
+        self._handle: asyncio.TimerHandle | None = None
+        # Strong references so in-flight flushes aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: str):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.pending.append((key, fut))
+        if self._handle is None:
+            self._handle = loop.call_later(self.delay, self._flush)
+        return await fut
+
+    def _flush(self):
+        self._handle = None
+        pending, self.pending = self.pending, []
+        task = asyncio.create_task(self._run(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: list[tuple[str, asyncio.Future]]):
+        keys = list({key for key, _ in pending})
+        try:
+            cursor = db.get_db()[self.collection].find({self.key_field: {'$in': keys}}, self.projection)
+            docs = await cursor.to_list(length=None)
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        by_key = {doc[self.key_field]: doc for doc in docs}
+        for key, fut in pending:
+            if not fut.done():
+                fut.set_result(by_key.get(key))
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import OrderedDict
+from functools import wraps
+
+class AsyncTTLCache:
+    """Cache an async function's results for `ttl` seconds; concurrent misses share one call.
+    Holds at most `maxsize` entries, evicting the least recently used."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache: OrderedDict = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        # Bumped by clear() so calls already in flight don't repopulate the cache with stale data
+        self._generation = 0
+
+    def clear(self):
+        self._cache.clear()
+        self._inflight.clear()
+        self._generation += 1
+
+    def __call__(self, func):
+        fname = func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            # frozenset is order-independent, so kwargs need no sorting
+            key = (fname, args, frozenset(kwargs.items())) if kwargs else (fname, args)
+            while True:
+                entry = self._cache.get(key)
+                if entry:
+                    if entry[1] > time.monotonic():
+                        self._cache.move_to_end(key)
+                        return entry[0]
+                    # Expired entries are dropped lazily on access
+                    del self._cache[key]
+
+                shared = self._inflight.get(key)
+                if shared is None:
+                    break
+                try:
+                    # Shield so a cancelled waiter doesn't cancel the shared call
+                    return await asyncio.shield(shared)
+                except asyncio.CancelledError:
+                    # Only the owning caller was cancelled, not this one: go round and make
+                    # (or join) a fresh call instead of passing its cancellation on
+                    if shared.cancelled() and not asyncio.current_task().cancelling():
+                        continue
+                    raise
+
+            fut = asyncio.get_running_loop().create_future()
+            self._inflight[key] = fut
+            generation = self._generation
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            except Exception as e:
+                fut.set_exception(e)
+                # Mark as retrieved so asyncio doesn't warn when nobody was waiting
+                fut.exception()
+                raise
+            else:
+                if generation == self._generation:
+                    self._cache[key] = (result, time.monotonic() + self.ttl)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.maxsize:
+                        self._cache.popitem(last=False)
+                fut.set_result(result)
+                return result
+            finally:
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+
+        wrapper.cache_clear = self.clear
+        return wrapper
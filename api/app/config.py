@@ -9,6 +9,9 @@ class Settings(BaseSettings):
     spotify_redirect_uri: str
     spotify_playlist_id: str
     cors_origins: str = "*"
+    # Async drivers multiplex well, so a small pool covers bursty guest traffic
+    mongo_max_pool_size: int = 20
+    mongo_min_pool_size: int = 5
 
     class Config:
         env_file = ".env"
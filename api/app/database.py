@@ -1,19 +1,30 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+# PyMongo's native asyncio client: I/O runs on the event loop rather than Motor's thread pool
+from pymongo import AsyncMongoClient
 from .config import get_settings
 
 settings = get_settings()
 
 class Database:
-    client: AsyncIOMotorClient = None
+    client: AsyncMongoClient = None
     db = None
 
     def connect(self):
-        self.client = AsyncIOMotorClient(settings.mongo_url)
+        self.client = AsyncMongoClient(
+            settings.mongo_url,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            maxIdleTimeMS=60000,
+            # Fail fast when Mongo is unreachable instead of hanging requests for the 30s default
+            serverSelectionTimeoutMS=3000,
+            connectTimeoutMS=3000,
+            # Decode BSON dates as aware UTC datetimes so readers can compare them directly
+            tz_aware=True
+        )
         self.db = self.client[settings.db_name]
 
-    def close(self):
+    async def close(self):
         if self.client:
-            self.client.close()
+            await self.client.close()
 
     def get_db(self):
         return self.db
@@ -1,16 +1,75 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager, suppress
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 import logging
+import logging.handlers
+import queue
 from .config import get_settings
 from .database import db
+from .spotify import open_http_client, close_http_client, get_valid_access_token, run_token_refresher
+from .services import ensure_indexes, migrate_string_timestamps
 from .routers import api
 
 settings = get_settings()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# While the app is serving, handlers run on a listener thread so formatting and stream I/O stay
+# off the event loop; outside the lifespan, records go straight to the stream handler
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# QueueHandler pre-renders the message (and traceback); the listener's handler adds the prefix
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Byron Bay Silent Disco API")
+@contextmanager
+def queued_logging():
+    """Route root logging through log_listener for the duration; stopping it flushes what's queued"""
+    root = logging.getLogger()
+    log_listener.start()
+    root.addHandler(_queue_handler)
+    root.removeHandler(_log_handler)
+    try:
+        yield
+    finally:
+        root.addHandler(_log_handler)
+        root.removeHandler(_queue_handler)
+        log_listener.stop()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with queued_logging():
+        db.connect()
+        open_http_client()
+        try:
+            # Warm the Mongo pool and the in-memory token so the first guest request doesn't pay for it.
+            # Both are best effort: routes that need Mongo fail on their own, and the rest keep serving
+            try:
+                await db.get_db().command('ping')
+                await ensure_indexes()
+                await migrate_string_timestamps()
+            except Exception as e:
+                logger.warning("Mongo warm-up skipped: %s", e)
+            try:
+                await get_valid_access_token()
+            except Exception as e:
+                logger.info("Spotify token not prefetched: %s", e)
+            token_refresher = asyncio.create_task(run_token_refresher())
+            try:
+                yield
+            finally:
+                token_refresher.cancel()
+                with suppress(asyncio.CancelledError):
+                    await token_refresher
+        finally:
+            await db.close()
+            await close_http_client()
+
+app = FastAPI(title="Byron Bay Silent Disco API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,12 +79,4 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("startup")
-async def startup_db_client():
-    db.connect()
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    db.close()
-
 app.include_router(api.router)
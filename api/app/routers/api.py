@@ -1,17 +1,16 @@
 from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
-from fastapi.responses import RedirectResponse
-import urllib.parse
+from fastapi.responses import RedirectResponse, ORJSONResponse, Response
+import asyncio
 import logging
-from datetime import datetime, timezone
+import orjson
 
-from ..models import SearchRequest, TrackRequest, PlaylistInfo, NowPlayingResponse
-from ..database import db
+from ..models import SearchRequest, TrackRequest
 from ..spotify import (
     spotify_request, 
     get_auth_url, 
     exchange_code_for_token, 
-    get_valid_access_token,
-    get_stored_tokens,
+    has_live_token,
+    has_stored_live_token,
     settings
 )
 from ..services import (
@@ -20,18 +19,45 @@ from ..services import (
     set_duplicate_lock, 
     release_duplicate_lock, 
     set_cooldown, 
-    add_guest_request, 
-    get_queue_position, 
-    COOLDOWN_SECONDS, 
-    DUPLICATE_LOCK_SECONDS
+    claim_now_playing_mark, 
+    record_guest_add, 
+    bulk_add_guest_requests, 
+    bulk_set_cooldowns, 
+    find_cooldowns, 
+    fresh_queue_position, 
+    current_now_playing, 
+    fetch_queue, 
+    fetch_playlist_info, 
+    get_cooldowns, 
+    get_recent_additions, 
+    track_id_from_uri, 
+    search_spotify, 
+    ALREADY_ADDING_MESSAGE
 )
 
 router = APIRouter(prefix="/api")
 logger = logging.getLogger(__name__)
 
+# Server-authored payloads for the polled endpoints are plain dicts (serialized by ORJSONResponse)
+DEFAULT_PLAYLIST_INFO = {'name': 'Silent Disco', 'color': '#ffffff'}
+NOT_PLAYING = {
+    'is_playing': False,
+    'song_name': None,
+    'artist': None,
+    'album_art': None,
+    'duration_ms': None,
+    'progress_ms': None,
+    'time_left_ms': None,
+    'track_uri': None
+}
+# Fixed bodies for the health-check style endpoints, encoded once at import
+ROOT_BODY = orjson.dumps({"message": "Byron Bay Silent Disco API"})
+AUTHENTICATED_BODY = orjson.dumps({"authenticated": True})
+NOT_AUTHENTICATED_BODY = orjson.dumps({"authenticated": False})
+
 @router.get("/")
 async def root():
-    return {"message": "Byron Bay Silent Disco API"}
+    return Response(ROOT_BODY, media_type="application/json")
 
 @router.get("/spotify/auth")
 async def spotify_auth():
@@ -48,248 +74,142 @@ async def spotify_callback(code: str = Query(...), error: str = Query(None)):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Callback error: {type(e).__name__}: {e}")
+        logger.exception("Callback error")
         raise HTTPException(status_code=500, detail=f"Callback error: {type(e).__name__}: {str(e)}")
 
 @router.get("/spotify/status")
 async def spotify_status():
-    token_doc = await get_stored_tokens()
-    if not token_doc:
-        return {"authenticated": False}
+    # Polled often: answer from the token cache, which the background refresher keeps warm.
+    # A cold cache gets one read-only Mongo lookup; refreshing is left to the refresher
+    if has_live_token():
+        return Response(AUTHENTICATED_BODY, media_type="application/json")
     try:
-        await get_valid_access_token()
-        return {"authenticated": True}
-    except:
-        return {"authenticated": False}
+        authenticated = await has_stored_live_token()
+    except Exception:
+        authenticated = False
+    return Response(AUTHENTICATED_BODY if authenticated else NOT_AUTHENTICATED_BODY, media_type="application/json")
 
 @router.get("/spotify/playlist-info")
 async def get_playlist_info():
     try:
-        response = await spotify_request('GET', f'/playlists/{settings.spotify_playlist_id}')
-        if response.status_code != 200:
-            return PlaylistInfo(name="Silent Disco", color="#ffffff")
-        data = response.json()
-        name = data.get('name', 'Silent Disco')
-        name_lower = name.lower()
-        if 'on red' in name_lower:
-            color = '#ff3b3b'
-        elif 'on blue' in name_lower:
-            color = '#00a0ff'
-        elif 'on green' in name_lower:
-            color = '#00ff7f'
-        else:
-            color = '#ffffff'
-        return PlaylistInfo(name=name, color=color)
-    except Exception as e:
-        logger.error(f"Error getting playlist info: {e}")
-        return PlaylistInfo(name="Silent Disco", color="#ffffff")
+        return await fetch_playlist_info()
+    except Exception:
+        logger.exception("Error getting playlist info")
+        return DEFAULT_PLAYLIST_INFO
 
 @router.get("/spotify/now-playing")
-async def get_now_playing():
+async def get_now_playing(background_tasks: BackgroundTasks):
     try:
-        response = await spotify_request('GET', '/me/player/currently-playing')
-        if response.status_code == 204 or not response.content:
-            return NowPlayingResponse(is_playing=False)
-        if response.status_code != 200:
-            return NowPlayingResponse(is_playing=False)
-        
-        data = response.json()
-        if not data or not data.get('item'):
-            return NowPlayingResponse(is_playing=False)
-        
-        track = data['item']
-        track_uri = track.get('uri')
-        
-        # Mark as played (set cooldown) when a track is now playing
-        if track_uri:
-            # We use background task concept here conceptually, but simple await is fine
-            await set_cooldown(track_uri)
-        
-        duration = track.get('duration_ms', 0)
-        progress = data.get('progress_ms', 0)
+        now_playing = await current_now_playing()
+        if not now_playing:
+            return NOT_PLAYING
         
-        return NowPlayingResponse(
-            is_playing=data.get('is_playing', False),
-            song_name=track.get('name'),
-            artist=', '.join([a['name'] for a in track.get('artists', [])]),
-            album_art=track['album']['images'][0]['url'] if track.get('album', {}).get('images') else None,
-            duration_ms=duration,
-            progress_ms=progress,
-            time_left_ms=duration - progress if duration and progress else None,
-            track_uri=track_uri
-        )
-    except Exception as e:
-        logger.error(f"Error getting now playing: {e}")
-        return NowPlayingResponse(is_playing=False)
+        # Mark as played (set cooldown) when a track is now playing. The write runs after the
+        # response is sent, and repeat polls of the same track skip it
+        track_uri = now_playing['track_uri']
+        if track_uri and claim_now_playing_mark(track_uri):
+            background_tasks.add_task(set_cooldown, track_uri)
+        return now_playing
+    except Exception:
+        logger.exception("Error getting now playing")
+        return NOT_PLAYING
+
+# /queue and /search return ORJSONResponse directly: their payloads are JSON-native already,
+# so FastAPI's jsonable_encoder pass over every nested dict is skipped
+async def queue_json() -> orjson.Fragment:
+    """Cached, pre-serialized queue array (empty on error), embedded as-is by orjson"""
+    try:
+        return orjson.Fragment(await fetch_queue())
+    except Exception:
+        logger.exception("Error getting queue")
+        return orjson.Fragment(b'[]')
 
 @router.get("/spotify/queue")
 async def get_queue():
-    try:
-        response = await spotify_request('GET', '/me/player/queue')
-        if response.status_code != 200:
-            return {"queue": []}
-        
-        data = response.json()
-        queue_items = data.get('queue', [])[:25]
-        
-        # Batch fetch
-        track_uris = [track.get('uri', '') for track in queue_items]
-        track_ids = [uri.split(':')[-1] if ':' in uri else uri for uri in track_uris]
-        
-        # Batch query for guest requests
-        guest_requests_cursor = db.get_db().guest_requests.find({'uri': {'$in': track_uris}}, {'_id': 0, 'uri': 1})
-        guest_request_uris = {doc['uri'] async for doc in guest_requests_cursor}
-        
-        # Batch query for cooldowns
-        cooldown_cursor = db.get_db().track_cooldown.find({'track_id': {'$in': track_ids}}, {'_id': 0, 'track_id': 1, 'timestamp': 1})
-        cooldown_map = {}
-        now = datetime.now(timezone.utc)
-        async for doc in cooldown_cursor:
-            last_time = doc.get('timestamp')
-            if last_time:
-                if isinstance(last_time, str):
-                    last_time = datetime.fromisoformat(last_time.replace('Z', '+00:00'))
-                elif last_time.tzinfo is None:
-                    last_time = last_time.replace(tzinfo=timezone.utc)
-                time_diff = (now - last_time).total_seconds()
-                if time_diff < COOLDOWN_SECONDS:
-                    cooldown_map[doc['track_id']] = int((COOLDOWN_SECONDS - time_diff) / 60)
-        
-        result = []
-        for track in queue_items:
-            uri = track.get('uri', '')
-            track_id = uri.split(':')[-1] if ':' in uri else uri
-            is_request = uri in guest_request_uris
-            cooldown_mins = cooldown_map.get(track_id, 0)
-            in_cooldown = cooldown_mins > 0
-            
-            result.append({
-                'uri': uri,
-                'name': track.get('name', 'Unknown'),
-                'artist': ', '.join([a['name'] for a in track.get('artists', [])]),
-                'album_art': track['album']['images'][0]['url'] if track.get('album', {}).get('images') else None,
-                'is_guest_request': is_request,
-                'in_cooldown': in_cooldown,
-                'cooldown_minutes': cooldown_mins
-            })
-        
-        return {"queue": result}
-    except Exception as e:
-        logger.error(f"Error getting queue: {e}")
-        return {"queue": []}
+    return ORJSONResponse({"queue": await queue_json()})
+
+# Initial guest-page load in one round trip; the parts are fetched concurrently and each falls
+# back on its own, exactly like its standalone endpoint
+@router.get("/spotify/dashboard")
+async def get_dashboard(background_tasks: BackgroundTasks):
+    now_playing, queue, playlist_info = await asyncio.gather(
+        get_now_playing(background_tasks),
+        queue_json(),
+        get_playlist_info()
+    )
+    return ORJSONResponse({"now_playing": now_playing, "queue": queue, "playlist_info": playlist_info})
 
 @router.post("/spotify/search")
 async def search_tracks(request: SearchRequest):
     try:
-        response = await spotify_request('GET', f'/search?q={urllib.parse.quote(request.query)}&type=track&limit=10')
-        if response.status_code != 200:
-            return {"tracks": []}
-        
-        data = response.json()
-        tracks = data.get('tracks', {}).get('items', [])
-        
-        track_ids = [track.get('uri', '').split(':')[-1] for track in tracks if track.get('uri')]
-        track_uris = [track.get('uri', '') for track in tracks if track.get('uri')]
+        # Results are cached and shared across guests, so copy before adding per-request flags
+        tracks = [dict(track) for track in await search_spotify(request.query.strip())]
         
-        # Batch query for cooldowns
-        cooldown_cursor = db.get_db().track_cooldown.find({'track_id': {'$in': track_ids}}, {'_id': 0, 'track_id': 1, 'timestamp': 1})
-        cooldown_map = {}
-        now = datetime.now(timezone.utc)
-        async for doc in cooldown_cursor:
-            last_time = doc.get('timestamp')
-            if last_time:
-                if isinstance(last_time, str):
-                    last_time = datetime.fromisoformat(last_time.replace('Z', '+00:00'))
-                elif last_time.tzinfo is None:
-                    last_time = last_time.replace(tzinfo=timezone.utc)
-                time_diff = (now - last_time).total_seconds()
-                if time_diff < COOLDOWN_SECONDS:
-                    cooldown_map[doc['track_id']] = int((COOLDOWN_SECONDS - time_diff) / 60)
+        # Derive each id once; the set, the dedupe and the flag loop below all reuse it
+        track_ids = [track_id_from_uri(track['uri']) for track in tracks]
+        unique_ids = tuple(sorted({track_id for track_id in track_ids if track_id}))
         
-        # Batch query for recent additions (duplicate prevention)
-        recent_cursor = db.get_db().recent_additions.find({'track_id': {'$in': track_ids}}, {'_id': 0, 'track_id': 1, 'added_at': 1})
-        recent_map = {}
-        async for doc in recent_cursor:
-            added_time = doc.get('added_at')
-            if added_time:
-                if isinstance(added_time, str):
-                    added_time = datetime.fromisoformat(added_time.replace('Z', '+00:00'))
-                elif added_time.tzinfo is None:
-                    added_time = added_time.replace(tzinfo=timezone.utc)
-                time_diff = (now - added_time).total_seconds()
-                if time_diff < DUPLICATE_LOCK_SECONDS:
-                    recent_map[doc['track_id']] = True
+        # Batch queries for cooldowns and recent additions (duplicate prevention),
+        # both shared across clients via TTL cache, run concurrently
+        cooldown_map, recent_ids = await asyncio.gather(
+            get_cooldowns(unique_ids),
+            get_recent_additions(unique_ids)
+        )
         
-        result = []
-        for track in tracks:
-            uri = track.get('uri', '')
-            track_id = uri.split(':')[-1] if ':' in uri else uri
+        for track, track_id in zip(tracks, track_ids):
             cooldown_mins = cooldown_map.get(track_id, 0)
-            in_cooldown = cooldown_mins > 0
-            recently_added = recent_map.get(track_id, False)
-            
-            result.append({
-                'uri': uri,
-                'name': track.get('name', 'Unknown'),
-                'artist': ', '.join([a['name'] for a in track.get('artists', [])]),
-                'album_art': track['album']['images'][0]['url'] if track.get('album', {}).get('images') else None,
-                'in_cooldown': in_cooldown,
-                'cooldown_minutes': cooldown_mins,
-                'recently_added': recently_added
-            })
+            track['in_cooldown'] = cooldown_mins > 0
+            track['cooldown_minutes'] = cooldown_mins
+            track['recently_added'] = track_id in recent_ids
         
-        return {"tracks": result}
-    except Exception as e:
-        logger.error(f"Error searching: {e}")
-        return {"tracks": []}
+        return ORJSONResponse({"tracks": tracks})
+    except Exception:
+        logger.exception("Error searching")
+        return ORJSONResponse({"tracks": []})
 
 @router.post("/spotify/add-track")
-async def add_track(request: TrackRequest):
+async def add_track(request: TrackRequest, background_tasks: BackgroundTasks):
     try:
-        # Check cooldown first
-        can_add, error_msg = await check_cooldown(request.track_uri)
-        if not can_add:
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        # Check duplicate lock (prevent rapid clicks)
-        can_add, error_msg = await check_duplicate_lock(request.track_uri)
-        if not can_add:
-            raise HTTPException(status_code=400, detail=error_msg)
+        # Check cooldown and duplicate lock (prevent rapid clicks) concurrently
+        (cooldown_ok, cooldown_msg), (dup_ok, dup_msg) = await asyncio.gather(
+            check_cooldown(request.track_uri),
+            check_duplicate_lock(request.track_uri)
+        )
+        # Cooldown takes precedence when both fail
+        if not cooldown_ok:
+            raise HTTPException(status_code=400, detail=cooldown_msg)
+        if not dup_ok:
+            raise HTTPException(status_code=400, detail=dup_msg)
         
         # Set lock immediately to prevent concurrent requests
-        await set_duplicate_lock(request.track_uri)
+        if not await set_duplicate_lock(request.track_uri):
+            raise HTTPException(status_code=400, detail=ALREADY_ADDING_MESSAGE)
         
         try:
             # Add to Spotify queue
-            response = await spotify_request('POST', f'/me/player/queue?uri={urllib.parse.quote(request.track_uri)}')
+            response = await spotify_request('POST', '/me/player/queue', params={'uri': request.track_uri})
             
             if response.status_code not in [200, 204]:
                 await release_duplicate_lock(request.track_uri)
-                error_data = response.json() if response.content else {}
+                error_data = orjson.loads(response.content) if response.content else {}
                 error_reason = error_data.get('error', {}).get('reason', '')
                 if error_reason == 'NO_ACTIVE_DEVICE':
                     raise HTTPException(status_code=400, detail="No active Spotify player. Please start playing music first.")
-                logger.error(f"Add track error: {response.status_code} - {response.text}")
+                logger.error("Add track error: %s - %s", response.status_code, response.text)
                 raise HTTPException(status_code=400, detail="Failed to add track to queue")
             
-            # Track as guest request
-            await add_guest_request(
+            # Track as guest request and set cooldown after the response is sent; the reply doesn't
+            # depend on them and the duplicate lock already blocks repeats until they land
+            background_tasks.add_task(
+                record_guest_add,
                 track_uri=request.track_uri,
                 track_name=request.track_name or "Unknown",
                 artist=request.artist or "Unknown",
                 album_art=request.album_art or ""
             )
-            
-            # Set cooldown
-            await set_cooldown(request.track_uri)
-            
-            # Get queue position from Spotify
-            # We don't use 'await asyncio.sleep(0.5)' here in production code usually but let's keep it if we want delay
-            # Just relying on next poll is often better, but for immediate feedback:
-            import asyncio
-            await asyncio.sleep(0.5) 
-            
-            position = await get_queue_position(request.track_uri)
+            # The position is a nicety the guest UI hides when unknown, so it gets one look
+            # rather than sleeping on retries
+            position = await fresh_queue_position(request.track_uri)
             
             position_text = f" at position #{position}" if position > 0 else ""
             
@@ -309,5 +229,68 @@ async def add_track(request: TrackRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error adding track: {e}")
+        logger.exception("Error adding track")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Spotify accepts at most 100 URIs per add-to-playlist call, which also caps one /add-tracks batch
+PLAYLIST_ADD_LIMIT = 100
+
+@router.post("/spotify/add-tracks")
+async def add_tracks(requests: list[TrackRequest]):
+    if not requests:
+        raise HTTPException(status_code=400, detail="No tracks to add")
+    # The route needs no login, so one request is capped at a single Spotify call and a bounded bulk_write
+    if len(requests) > PLAYLIST_ADD_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PLAYLIST_ADD_LIMIT} tracks can be added at once")
+    try:
+        # Drop repeats within the batch, keeping the first occurrence
+        unique = {}
+        for req in requests:
+            unique.setdefault(req.track_uri, req)
+        tracks = list(unique.values())
+        
+        # One fresh (uncached) cooldown query for the whole batch
+        track_ids = {uri: track_id_from_uri(uri) for uri in unique}
+        cooldown_map = await find_cooldowns(tuple(set(track_ids.values())))
+        eligible = [t for t in tracks if track_ids[t.track_uri] not in cooldown_map]
+        skipped = [
+            {'uri': t.track_uri, 'cooldown_minutes': cooldown_map[track_ids[t.track_uri]]}
+            for t in tracks if track_ids[t.track_uri] in cooldown_map
+        ]
+        if not eligible:
+            return {"success": False, "message": "All of these songs were played recently.", "added": [], "skipped": skipped}
+        
+        uris = [t.track_uri for t in eligible]
+        response = await spotify_request(
+            'POST',
+            f'/playlists/{settings.spotify_playlist_id}/tracks',
+            json={'uris': uris}
+        )
+        if response.status_code not in [200, 201]:
+            logger.error("Add tracks error: %s - %s", response.status_code, response.text)
+            raise HTTPException(status_code=400, detail="Failed to add tracks to playlist")
+        
+        # Track as guest requests and set cooldowns, one bulk_write per collection. The songs are on
+        # the playlist by now, so a bookkeeping failure is logged rather than reported as a failed add
+        try:
+            await asyncio.gather(
+                bulk_add_guest_requests([
+                    {'uri': t.track_uri, 'name': t.track_name or "Unknown", 'artist': t.artist or "Unknown", 'album_art': t.album_art or ""}
+                    for t in eligible
+                ]),
+                bulk_set_cooldowns(uris)
+            )
+        except Exception:
+            logger.exception("Error recording added tracks")
+        
+        return {
+            "success": True,
+            "message": f"Added {len(uris)} songs!",
+            "added": uris,
+            "skipped": skipped
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error adding tracks")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,6 +1,14 @@
-from datetime import datetime, timezone
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+import orjson
 from .database import db
-from .spotify import spotify_request
+from .spotify import spotify_request, settings
+from .cache import AsyncTTLCache
+from .batching import Batcher
 
 # Cooldown: 1 hour in seconds
 COOLDOWN_SECONDS = 3600
@@ -8,101 +16,401 @@ COOLDOWN_SECONDS = 3600
 # Duplicate prevention: Lock time in seconds (prevents rapid clicks)
 DUPLICATE_LOCK_SECONDS = 30
 
-# In-memory lock for preventing duplicate submissions
-pending_requests = {}
+# In-memory lock for preventing duplicate submissions, kept in insertion (= time) order.
+# Entries older than PENDING_LOCK_SECONDS are stale and pruned on the next check
+PENDING_LOCK_SECONDS = 5
+pending_requests: OrderedDict[str, float] = OrderedDict()
+ALREADY_ADDING_MESSAGE = "This song is already being added. Please wait."
+
+def _prune_pending():
+    """Drop stale in-memory locks; only expired entries at the front are visited"""
+    # Lock times are time.monotonic() floats; they never leave the process, so no datetimes are needed
+    cutoff = time.monotonic() - PENDING_LOCK_SECONDS
+    while pending_requests:
+        track_id, lock_time = next(iter(pending_requests.items()))
+        if lock_time >= cutoff:
+            break
+        del pending_requests[track_id]
+
+# Now-playing is polled every few seconds by every guest; refresh its cooldown at most this often
+NOW_PLAYING_MARK_SECONDS = 60
+_last_now_playing_mark = {'uri': None, 'at': 0.0}
+
+def claim_now_playing_mark(track_uri: str) -> bool:
+    """True if the now-playing track's cooldown is due for a write (and records that it was claimed)"""
+    now = time.monotonic()
+    if _last_now_playing_mark['uri'] == track_uri and now - _last_now_playing_mark['at'] < NOW_PLAYING_MARK_SECONDS:
+        return False
+    _last_now_playing_mark.update(uri=track_uri, at=now)
+    return True
+
+# Tracks known to be cooling down (track_id -> cooldown start), so repeat requests skip Mongo.
+# Only hits are remembered; Mongo stays the source of truth for everything else
+COOLDOWN_CACHE_SIZE = 4096
+known_cooldowns: OrderedDict[str, datetime] = OrderedDict()
+
+def _remember_cooldown(track_id: str, started_at: datetime):
+    known_cooldowns[track_id] = started_at
+    known_cooldowns.move_to_end(track_id)
+    while len(known_cooldowns) > COOLDOWN_CACHE_SIZE:
+        known_cooldowns.popitem(last=False)
+
+# Point reads from concurrent /add-track calls are merged into one $in query per collection
+cooldown_batcher = Batcher('track_cooldown', 'track_id', {'_id': 0, 'track_id': 1, 'timestamp': 1})
+recent_additions_batcher = Batcher('recent_additions', 'track_id', {'_id': 0, 'track_id': 1, 'added_at': 1})
+
+def track_id_from_uri(uri: str) -> str:
+    """'spotify:track:<id>' -> '<id>'; a bare id (or a malformed 'x:' uri) is returned unchanged"""
+    return uri.rpartition(':')[2] or uri
+
+def _extract_track_fields(track: dict) -> tuple[str, str | None]:
+    """(artist string, first album image url) of a Spotify track object; tolerates null album/artists"""
+    imgs = (track.get('album') or {}).get('images') or ()
+    return ', '.join(a['name'] for a in track.get('artists') or ()), imgs[0]['url'] if imgs else None
+
+def thin_track(track: dict) -> dict:
+    """Reduce a Spotify track object to the fields the API returns"""
+    artist, album_art = _extract_track_fields(track)
+    return {
+        'uri': track.get('uri', ''),
+        'name': track.get('name', 'Unknown'),
+        'artist': artist,
+        'album_art': album_art
+    }
+
+# Mongo's error code when an index already exists with different options
+INDEX_OPTIONS_CONFLICT = 85
+
+async def _ensure_ttl_index(collection: str, field: str, seconds: int):
+    """Create a TTL index, or retune expireAfterSeconds in place if it exists with another value"""
+    database = db.get_db()
+    try:
+        await database[collection].create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await database.command('collMod', collection, index={'keyPattern': {field: 1}, 'expireAfterSeconds': seconds})
+
+# Mongo's error code for a unique index violation
+DUPLICATE_KEY = 11000
+
+async def _ensure_unique_index(collection: str, field: str, newest_field: str):
+    """Create a unique index on `field`; if existing docs collide, keep the newest per key and retry"""
+    coll = db.get_db()[collection]
+    try:
+        await coll.create_index(field, unique=True)
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+    else:
+        return
+    # Concurrent upserts made before the index existed can leave several docs per key
+    cursor = await coll.aggregate([
+        {'$sort': {newest_field: -1, '_id': -1}},
+        {'$group': {'_id': f'${field}', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    async for group in cursor:
+        await coll.delete_many({'_id': {'$in': group['ids'][1:]}})
+    await coll.create_index(field, unique=True)
+
+async def ensure_indexes():
+    """Create lookup and TTL indexes for the hot-path collections (idempotent, run on startup)"""
+    await _ensure_unique_index('track_cooldown', 'track_id', 'timestamp')
+    # Cooldown docs are deleted once the cooldown is over (the TTL monitor runs about once a minute)
+    await _ensure_ttl_index('track_cooldown', 'timestamp', COOLDOWN_SECONDS)
+    await _ensure_unique_index('recent_additions', 'track_id', 'added_at')
+    # Readers still check the window themselves, so docs lingering until the next TTL pass are harmless
+    await _ensure_ttl_index('recent_additions', 'added_at', DUPLICATE_LOCK_SECONDS)
+    await _ensure_unique_index('guest_requests', 'uri', 'requested_at')
+
+def _to_utc(ts) -> datetime:
+    """Normalize a stored timestamp to an aware UTC datetime (the client is tz_aware; naive values are legacy)"""
+    if isinstance(ts, datetime):
+        return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+    # Legacy ISO strings; migrate_string_timestamps converts these at startup
+    return datetime.fromisoformat(ts[:-1] + '+00:00' if ts.endswith('Z') else ts)
+
+async def migrate_string_timestamps():
+    """One-time fix-up of legacy ISO-string timestamps to BSON dates (TTL indexes skip strings)"""
+    for collection, field in (('track_cooldown', 'timestamp'), ('recent_additions', 'added_at')):
+        coll = db.get_db()[collection]
+        async for doc in coll.find({field: {'$type': 'string'}}, {field: 1}):
+            await coll.update_one({'_id': doc['_id']}, {'$set': {field: _to_utc(doc[field])}})
 
 async def check_cooldown(track_uri: str) -> tuple[bool, str]:
     """Check if track is in cooldown. Returns (can_add, error_message)"""
-    track_id = track_uri.split(':')[-1] if ':' in track_uri else track_uri
-    doc = await db.get_db().track_cooldown.find_one({'track_id': track_id}, {'_id': 0, 'track_id': 1, 'timestamp': 1})
-    if not doc:
-        return True, ""
+    track_id = track_id_from_uri(track_uri)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=COOLDOWN_SECONDS)
+    last_time = known_cooldowns.get(track_id)
+    if last_time is None or last_time <= cutoff:
+        known_cooldowns.pop(track_id, None)
+        doc = await cooldown_batcher.load(track_id)
+        if not doc or not doc.get('timestamp'):
+            return True, ""
+        last_time = _to_utc(doc['timestamp'])
+        if last_time > cutoff:
+            _remember_cooldown(track_id, last_time)
     
-    last_time = doc.get('timestamp')
-    if not last_time:
-        return True, ""
-    
-    if isinstance(last_time, str):
-        last_time = datetime.fromisoformat(last_time.replace('Z', '+00:00'))
-    elif last_time.tzinfo is None:
-        last_time = last_time.replace(tzinfo=timezone.utc)
-    
-    now = datetime.now(timezone.utc)
-    time_diff = (now - last_time).total_seconds()
-    if time_diff < COOLDOWN_SECONDS:
-        mins_left = int((COOLDOWN_SECONDS - time_diff) / 60)
+    if last_time > cutoff:
+        mins_left = int((last_time - cutoff).total_seconds() / 60)
         return False, f"This song was played recently. Try again in {mins_left} minutes!"
     return True, ""
 
+async def find_cooldowns(track_ids: tuple[str, ...]) -> dict[str, int]:
+    """Batch lookup of minutes left in cooldown, keyed by track_id (only tracks still cooling down)"""
+    # PyMongo's to_list rejects length=0, and there is nothing to look up anyway
+    if not track_ids:
+        return {}
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=COOLDOWN_SECONDS)
+    # Mongo filters out expired cooldowns and computes minutes left, so only live ids and ints come back
+    cursor = await db.get_db().track_cooldown.aggregate([
+        {'$match': {'track_id': {'$in': list(track_ids)}, 'timestamp': {'$gt': cutoff}}},
+        {'$project': {
+            '_id': 0,
+            'track_id': 1,
+            'minutes': {'$floor': {'$divide': [{'$subtract': ['$timestamp', cutoff]}, 60000]}}
+        }}
+    ])
+    docs = await cursor.to_list(length=len(track_ids))
+    return {doc['track_id']: int(doc['minutes']) for doc in docs}
+
+@AsyncTTLCache(ttl=15)
+async def get_cooldowns(track_ids: tuple[str, ...]) -> dict[str, int]:
+    """find_cooldowns shared across polling clients; adds gate on the uncached version"""
+    return await find_cooldowns(track_ids)
+
+# Shorter TTL than cooldowns: the duplicate window is only 30s and guests need near-real-time feedback
+@AsyncTTLCache(ttl=5)
+async def get_recent_additions(track_ids: tuple[str, ...]) -> set[str]:
+    """Batch lookup of track_ids added within the duplicate-lock window"""
+    if not track_ids:
+        return set()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=DUPLICATE_LOCK_SECONDS)
+    # The window is checked by Mongo, so no timestamps are decoded or compared here
+    docs = await db.get_db().recent_additions.find(
+        {'track_id': {'$in': list(track_ids)}, 'added_at': {'$gt': cutoff}}, {'_id': 0, 'track_id': 1}
+    ).to_list(length=len(track_ids))
+    return {doc['track_id'] for doc in docs}
+
 async def check_duplicate_lock(track_uri: str) -> tuple[bool, str]:
     """Check if track is currently being added (prevent rapid duplicate clicks)"""
-    track_id = track_uri.split(':')[-1] if ':' in track_uri else track_uri
+    track_id = track_id_from_uri(track_uri)
     
-    # Check in-memory lock first (for very rapid clicks)
+    # Check in-memory lock first (for very rapid clicks); anything left after pruning is fresh
+    _prune_pending()
     if track_id in pending_requests:
-        lock_time = pending_requests[track_id]
-        if (datetime.now(timezone.utc) - lock_time).total_seconds() < 5:
-            return False, "This song is already being added. Please wait."
+        return False, ALREADY_ADDING_MESSAGE
     
     # Check database for recent additions
-    doc = await db.get_db().recent_additions.find_one({'track_id': track_id}, {'_id': 0, 'track_id': 1, 'added_at': 1})
+    doc = await recent_additions_batcher.load(track_id)
     if doc:
         added_time = doc.get('added_at')
-        if added_time:
-            if isinstance(added_time, str):
-                added_time = datetime.fromisoformat(added_time.replace('Z', '+00:00'))
-            elif added_time.tzinfo is None:
-                added_time = added_time.replace(tzinfo=timezone.utc)
-            
-            time_diff = (datetime.now(timezone.utc) - added_time).total_seconds()
-            if time_diff < DUPLICATE_LOCK_SECONDS:
-                return False, "This song was just added! Check the queue."
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=DUPLICATE_LOCK_SECONDS)
+        if added_time and _to_utc(added_time) > cutoff:
+            return False, "This song was just added! Check the queue."
     
     return True, ""
 
-async def set_duplicate_lock(track_uri: str):
-    """Set a lock to prevent duplicate additions"""
-    track_id = track_uri.split(':')[-1] if ':' in track_uri else track_uri
-    pending_requests[track_id] = datetime.now(timezone.utc)
+async def set_duplicate_lock(track_uri: str) -> bool:
+    """Set a lock to prevent duplicate additions. Returns False if another request already holds it"""
+    track_id = track_id_from_uri(track_uri)
+    # Check-and-set with no await in between: requests that both passed check_duplicate_lock
+    # while its reads were in flight can't both claim the lock
+    _prune_pending()
+    if track_id in pending_requests:
+        return False
+    pending_requests[track_id] = time.monotonic()
     await db.get_db().recent_additions.update_one(
         {'track_id': track_id},
         {'$set': {'track_id': track_id, 'added_at': datetime.now(timezone.utc)}},
         upsert=True
     )
+    return True
 
 async def release_duplicate_lock(track_uri: str):
     """Release the in-memory lock"""
-    track_id = track_uri.split(':')[-1] if ':' in track_uri else track_uri
-    if track_id in pending_requests:
-        del pending_requests[track_id]
+    track_id = track_id_from_uri(track_uri)
+    pending_requests.pop(track_id, None)
 
-async def set_cooldown(track_uri: str):
-    """Set cooldown timestamp for a track"""
-    track_id = track_uri.split(':')[-1] if ':' in track_uri else track_uri
+async def set_cooldown(track_uri: str, now: datetime | None = None):
+    """Set cooldown timestamp for a track (callers doing several writes can share one `now`)"""
+    track_id = track_id_from_uri(track_uri)
+    now = now or datetime.now(timezone.utc)
     await db.get_db().track_cooldown.update_one(
         {'track_id': track_id},
-        {'$set': {'track_id': track_id, 'track_uri': track_uri, 'timestamp': datetime.now(timezone.utc)}},
+        {'$set': {'track_id': track_id, 'track_uri': track_uri, 'timestamp': now}},
         upsert=True
     )
+    _remember_cooldown(track_id, now)
 
-async def add_guest_request(track_uri: str, track_name: str, artist: str, album_art: str):
+async def bulk_set_cooldowns(track_uris: list[str]):
+    """Set cooldown timestamps for many tracks in one unordered bulk_write round-trip"""
+    if not track_uris:
+        return
+    now = datetime.now(timezone.utc)
+    ops = []
+    for track_uri in track_uris:
+        track_id = track_id_from_uri(track_uri)
+        ops.append(UpdateOne(
+            {'track_id': track_id},
+            {'$set': {'track_id': track_id, 'track_uri': track_uri, 'timestamp': now}},
+            upsert=True
+        ))
+    await db.get_db().track_cooldown.bulk_write(ops, ordered=False)
+    for track_uri in track_uris:
+        _remember_cooldown(track_id_from_uri(track_uri), now)
+
+async def add_guest_request(track_uri: str, track_name: str, artist: str, album_art: str, now: datetime | None = None):
     """Track a guest request"""
     await db.get_db().guest_requests.update_one(
         {'uri': track_uri},
-        {'$set': {'uri': track_uri, 'name': track_name, 'artist': artist, 'album_art': album_art, 'requested_at': datetime.now(timezone.utc)}},
+        {'$set': {'uri': track_uri, 'name': track_name, 'artist': artist, 'album_art': album_art, 'requested_at': now or datetime.now(timezone.utc)}},
         upsert=True
     )
 
+async def record_guest_add(track_uri: str, track_name: str, artist: str, album_art: str):
+    """Bookkeeping after a successful add: guest request and cooldown (one shared timestamp),
+    then drop the /queue snapshot and cached cooldown maps so the next poll shows the track flagged"""
+    now = datetime.now(timezone.utc)
+    await asyncio.gather(
+        add_guest_request(track_uri, track_name, artist, album_art, now=now),
+        set_cooldown(track_uri, now=now)
+    )
+    # A queue rebuild that ran before the cooldown landed may have cached a map without it
+    get_cooldowns.cache_clear()
+    fetch_queue.cache_clear()
+
+async def bulk_add_guest_requests(tracks: list[dict]):
+    """Track many guest requests (dicts with uri, name, artist, album_art) in one bulk_write"""
+    if not tracks:
+        return
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne({'uri': track['uri']}, {'$set': {**track, 'requested_at': now}}, upsert=True)
+        for track in tracks
+    ]
+    await db.get_db().guest_requests.bulk_write(ops, ordered=False)
+
+# Playlist name keyword -> theme color, checked in order
+PLAYLIST_COLORS = (('on red', '#ff3b3b'), ('on blue', '#00a0ff'), ('on green', '#00ff7f'))
+
+def playlist_color(name: str) -> str:
+    name_lower = name.lower()
+    return next((color for keyword, color in PLAYLIST_COLORS if keyword in name_lower), '#ffffff')
+
+# A rename shows up within five minutes; page loads otherwise never wait on Spotify for this
+@AsyncTTLCache(ttl=300)
+async def fetch_playlist_info() -> dict:
+    """Playlist name and theme color; the DJ rarely renames it, so guests share one lookup per TTL"""
+    # Only the name is used; without fields= Spotify also sends the first page of tracks
+    response = await spotify_request('GET', f'/playlists/{settings.spotify_playlist_id}', params={'fields': 'name'})
+    # Raise rather than return a fallback: errors aren't cached, so a blip doesn't stick for the whole TTL
+    response.raise_for_status()
+    name = orjson.loads(response.content).get('name', 'Silent Disco')
+    return {'name': name, 'color': playlist_color(name)}
+
+@AsyncTTLCache(ttl=2)
+async def get_spotify_queue() -> list[dict]:
+    """Spotify's upcoming queue, shared by /queue polls and queue-position lookups for a couple of seconds"""
+    response = await spotify_request('GET', '/me/player/queue')
+    if response.status_code != 200:
+        return []
+    return [thin_track(track) for track in orjson.loads(response.content).get('queue', [])]
+
+@AsyncTTLCache(ttl=1)
+async def fetch_now_playing() -> tuple[dict, float] | None:
+    """Current track payload (and when it was fetched) shared by every polling guest for a second;
+    None when nothing is playing"""
+    response = await spotify_request('GET', '/me/player/currently-playing')
+    if response.status_code != 200 or not response.content:
+        return None
+    data = orjson.loads(response.content)
+    if not data or not data.get('item'):
+        return None
+    
+    track = data['item']
+    duration = track.get('duration_ms', 0)
+    progress = data.get('progress_ms', 0)
+    artist, album_art = _extract_track_fields(track)
+    return {
+        'is_playing': data.get('is_playing', False),
+        'song_name': track.get('name'),
+        'artist': artist,
+        'album_art': album_art,
+        'duration_ms': duration,
+        'progress_ms': progress,
+        'time_left_ms': duration - progress if duration and progress else None,
+        'track_uri': track.get('uri')
+    }, time.monotonic()
+
+async def current_now_playing() -> dict | None:
+    """fetch_now_playing with playback progress advanced to now, so cached polls still count down smoothly"""
+    snapshot = await fetch_now_playing()
+    if not snapshot:
+        return None
+    payload, fetched_at = snapshot
+    duration = payload['duration_ms']
+    if not payload['is_playing'] or not duration or not payload['progress_ms']:
+        return payload
+    progress = min(payload['progress_ms'] + int((time.monotonic() - fetched_at) * 1000), duration)
+    return {**payload, 'progress_ms': progress, 'time_left_ms': duration - progress}
+
+@AsyncTTLCache(ttl=3)
+async def fetch_queue() -> bytes:
+    """Upcoming tracks with guest-request and cooldown flags as a JSON array, built and
+    serialized once per TTL so repeat polls just embed the cached bytes"""
+    queue_items = (await get_spotify_queue())[:25]
+    if not queue_items:
+        return b'[]'
+    
+    # Batch fetch
+    track_uris = [track['uri'] for track in queue_items]
+    track_ids = [track_id_from_uri(uri) for uri in track_uris]
+    # The queue can repeat a track; dedupe so $in carries each key once (also a stable cache key)
+    unique_ids = tuple(sorted(set(track_ids)))
+    
+    # Batch queries for guest requests (distinct is resolved server-side) and
+    # cooldowns (shared across polling clients via TTL cache), run concurrently
+    guest_uris, cooldown_map = await asyncio.gather(
+        db.get_db().guest_requests.distinct('uri', {'uri': {'$in': list(set(track_uris))}}),
+        get_cooldowns(unique_ids)
+    )
+    guest_request_uris = set(guest_uris)
+    
+    result = []
+    for track, uri, track_id in zip(queue_items, track_uris, track_ids):
+        cooldown_mins = cooldown_map.get(track_id, 0)
+        # Queue items are cached and shared, so copy before adding the flags
+        item = dict(track)
+        item['is_guest_request'] = uri in guest_request_uris
+        item['in_cooldown'] = cooldown_mins > 0
+        item['cooldown_minutes'] = cooldown_mins
+        result.append(item)
+    return orjson.dumps(result)
+
+# Catalog results for a query barely change over minutes, so repeat searches skip Spotify
+@AsyncTTLCache(ttl=300)
+async def search_spotify(query: str) -> list[dict]:
+    """Thinned tracks for a search query"""
+    response = await spotify_request('GET', '/search', params={'q': query, 'type': 'track', 'limit': 10})
+    # Raise rather than return [] so a failed search isn't cached for the whole TTL
+    response.raise_for_status()
+    return [thin_track(track) for track in orjson.loads(response.content).get('tracks', {}).get('items', [])]
+
 async def get_queue_position(track_uri: str) -> int:
     """Get the position of a track in the current queue"""
     try:
-        response = await spotify_request('GET', '/me/player/queue')
-        if response.status_code == 200:
-            data = response.json()
-            queue_items = data.get('queue', [])
-            for i, track in enumerate(queue_items):
-                if track.get('uri') == track_uri:
-                    return i + 1  # 1-indexed position
+        queue_items = await get_spotify_queue()
+        for i, track in enumerate(queue_items):
+            if track.get('uri') == track_uri:
+                return i + 1  # 1-indexed position
         return -1
     except:
         return -1
+
+async def fresh_queue_position(track_uri: str) -> int:
+    """Queue position of a track that was just added; -1 if Spotify hasn't listed it yet"""
+    # The shared queue cache may predate the add, so force a fresh fetch (which also refreshes it for /queue)
+    get_spotify_queue.cache_clear()
+    return await get_queue_position(track_uri)
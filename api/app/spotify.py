@@ -1,8 +1,10 @@
+import asyncio
 import httpx
 import base64
 import urllib.parse
 import logging
-from datetime import datetime, timezone
+import time
+import orjson
 from fastapi import HTTPException
 from .config import get_settings
 from .database import db
@@ -14,52 +16,167 @@ SPOTIFY_AUTH_URL = 'https://accounts.spotify.com/authorize'
 SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
 SPOTIFY_API_URL = 'https://api.spotify.com/v1'
 
+# Client credentials never change at runtime, so the token endpoint headers are built once
+SPOTIFY_BASIC_AUTH = 'Basic ' + base64.b64encode(f"{settings.spotify_client_id}:{settings.spotify_client_secret}".encode()).decode()
+TOKEN_HEADERS = {'Authorization': SPOTIFY_BASIC_AUTH, 'Content-Type': 'application/x-www-form-urlencoded'}
+
+# Shared HTTP clients, created on app startup so every Spotify call reuses pooled connections.
+# Token calls get their own small pool on accounts.spotify.com so they never queue behind API traffic
+spotify_client: httpx.AsyncClient | None = None
+accounts_client: httpx.AsyncClient | None = None
+
+def open_http_client():
+    global spotify_client, accounts_client
+    spotify_client = httpx.AsyncClient(
+        base_url=SPOTIFY_API_URL,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(10.0, connect=3.0)
+    )
+    accounts_client = httpx.AsyncClient(
+        headers=TOKEN_HEADERS,
+        http2=True,
+        limits=httpx.Limits(max_connections=5, max_keepalive_connections=2),
+        timeout=httpx.Timeout(10.0, connect=3.0)
+    )
+
+async def close_http_client():
+    if spotify_client:
+        await spotify_client.aclose()
+    if accounts_client:
+        await accounts_client.aclose()
+
+# In-process copy of the current access token so API calls skip the Mongo lookup
+_token_cache: dict = {}
+# Seconds before expires_at at which a token is treated as stale and refreshed
+TOKEN_REFRESH_MARGIN = 30
+# Serializes cache misses so concurrent callers trigger at most one Mongo read / refresh
+_token_lock = asyncio.Lock()
+
+def _cache_token(access_token: str, expires_at: float):
+    _token_cache.update(access_token=access_token, expires_at=expires_at)
+    # Set the bearer header once per token instead of building it on every API call
+    spotify_client.headers['Authorization'] = f'Bearer {access_token}'
+
+def has_live_token() -> bool:
+    """True if the in-process token is still valid; no I/O"""
+    return _token_cache.get('expires_at', 0) > time.time()
+
 async def get_stored_tokens():
-    return await db.get_db().spotify_tokens.find_one({'_id': 'main'}, {'_id': 1, 'access_token': 1, 'refresh_token': 1, 'expires_at': 1})
+    return await db.get_db().spotify_tokens.find_one({'_id': 'main'}, {'_id': 0, 'access_token': 1, 'refresh_token': 1, 'expires_at': 1})
+
+async def has_stored_live_token() -> bool:
+    """has_live_token for a cold cache: reads the token another worker may have stored, never refreshes"""
+    token_doc = await get_stored_tokens()
+    if not token_doc or token_doc.get('expires_at', 0) <= time.time():
+        return False
+    _cache_token(token_doc['access_token'], token_doc['expires_at'])
+    return True
 
 async def store_tokens(access_token: str, refresh_token: str, expires_in: int):
-    expires_at = datetime.now(timezone.utc).timestamp() + expires_in - 60
+    expires_at = time.time() + expires_in - 60
     await db.get_db().spotify_tokens.update_one(
         {'_id': 'main'},
         {'$set': {'access_token': access_token, 'refresh_token': refresh_token, 'expires_at': expires_at}},
         upsert=True
     )
+    _cache_token(access_token, expires_at)
 
-async def refresh_access_token():
-    token_doc = await get_stored_tokens()
+async def refresh_access_token(token_doc: dict | None = None):
+    # Callers that just read the token doc pass it in to save a second Mongo round trip
+    token_doc = token_doc or await get_stored_tokens()
     if not token_doc or 'refresh_token' not in token_doc:
         raise HTTPException(status_code=401, detail="Not authenticated. Please visit /admin")
     
-    auth_header = base64.b64encode(f"{settings.spotify_client_id}:{settings.spotify_client_secret}".encode()).decode()
-    async with httpx.AsyncClient() as http_client:
-        response = await http_client.post(
-            SPOTIFY_TOKEN_URL,
-            headers={'Authorization': f'Basic {auth_header}', 'Content-Type': 'application/x-www-form-urlencoded'},
-            data={'grant_type': 'refresh_token', 'refresh_token': token_doc['refresh_token']}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Failed to refresh token")
-        data = response.json()
-        # Some refresh responses don't include a new refresh token, so we fallback to the old one
-        new_refresh_token = data.get('refresh_token', token_doc['refresh_token'])
-        await store_tokens(data['access_token'], new_refresh_token, data['expires_in'])
-        return data['access_token']
+    response = await accounts_client.post(
+        SPOTIFY_TOKEN_URL,
+        data={'grant_type': 'refresh_token', 'refresh_token': token_doc['refresh_token']}
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Failed to refresh token")
+    data = orjson.loads(response.content)
+    # Some refresh responses don't include a new refresh token, so we fallback to the old one
+    new_refresh_token = data.get('refresh_token', token_doc['refresh_token'])
+    await store_tokens(data['access_token'], new_refresh_token, data['expires_in'])
+    return data['access_token']
 
 async def get_valid_access_token():
-    token_doc = await get_stored_tokens()
-    if not token_doc:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    if datetime.now(timezone.utc).timestamp() >= token_doc.get('expires_at', 0):
-        return await refresh_access_token()
-    return token_doc['access_token']
+    if _token_cache.get('expires_at', 0) > time.time() + TOKEN_REFRESH_MARGIN:
+        return _token_cache['access_token']
+    async with _token_lock:
+        # Another caller may have refreshed the token while we waited for the lock
+        now = time.time()
+        if _token_cache.get('expires_at', 0) > now + TOKEN_REFRESH_MARGIN:
+            return _token_cache['access_token']
+        token_doc = await get_stored_tokens()
+        if not token_doc:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        # Same margin as the fast path, otherwise a token inside the margin would be
+        # re-read from Mongo on every call until it actually expired
+        if now + TOKEN_REFRESH_MARGIN >= token_doc.get('expires_at', 0):
+            return await refresh_access_token(token_doc)
+        _cache_token(token_doc['access_token'], token_doc['expires_at'])
+        return token_doc['access_token']
+
+# The background refresher renews the token this long before expiry, well ahead of
+# TOKEN_REFRESH_MARGIN, so requests never wait on the token endpoint
+BACKGROUND_REFRESH_LEAD = 120
+# How long the refresher waits after a failed refresh (or while nobody is logged in)
+REFRESHER_RETRY_SECONDS = 60
+
+async def run_token_refresher():
+    """Keep the cached token fresh ahead of expiry; runs for the app's lifetime"""
+    while True:
+        delay = _token_cache.get('expires_at', 0) - BACKGROUND_REFRESH_LEAD - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            async with _token_lock:
+                # A request may have refreshed (or logged in) while we slept
+                if _token_cache.get('expires_at', 0) - BACKGROUND_REFRESH_LEAD <= time.time():
+                    await refresh_access_token()
+        except Exception as e:
+            logger.info("Background token refresh skipped: %s", e)
+            await asyncio.sleep(REFRESHER_RETRY_SECONDS)
+
+# Caps concurrent Spotify calls so a burst of guests can't trip the rate limiter
+_spotify_semaphore = asyncio.Semaphore(10)
+# Longest Retry-After worth waiting out inside a request; longer penalties are returned as-is
+MAX_RETRY_AFTER_SECONDS = 5
+
+async def _send(method: str, endpoint: str, **kwargs):
+    async with _spotify_semaphore:
+        return await spotify_client.request(method, endpoint, **kwargs)
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.headers.get('Retry-After', 1))
+    except ValueError:
+        return 1.0
 
 async def spotify_request(method: str, endpoint: str, **kwargs):
-    access_token = await get_valid_access_token()
-    async with httpx.AsyncClient() as http_client:
-        return await http_client.request(method, f"{SPOTIFY_API_URL}{endpoint}", headers={'Authorization': f'Bearer {access_token}'}, **kwargs)
+    # Makes sure the client's default Authorization header holds a live token
+    await get_valid_access_token()
+    response = await _send(method, endpoint, **kwargs)
+    if response.status_code == 401:
+        # Token was rejected early (e.g. revoked); refresh once and retry, unless a
+        # concurrent caller already swapped in a new token while this request was in flight
+        async with _token_lock:
+            if response.request.headers.get('Authorization') == spotify_client.headers.get('Authorization'):
+                await refresh_access_token()
+        response = await _send(method, endpoint, **kwargs)
+    if response.status_code == 429:
+        # Rate limited: wait out a short penalty (outside the semaphore) and retry once
+        delay = _retry_after(response)
+        if delay <= MAX_RETRY_AFTER_SECONDS:
+            logger.info("Spotify rate limited %s %s, retrying in %ss", method, endpoint, delay)
+            await asyncio.sleep(delay)
+            response = await _send(method, endpoint, **kwargs)
+    return response
 
 def get_auth_url():
-    scope = "user-read-playback-state user-modify-playback-state user-read-currently-playing playlist-read-private"
+    # playlist-modify-* is needed by /add-tracks; tokens granted before it was added must be re-authorized
+    scope = "user-read-playback-state user-modify-playback-state user-read-currently-playing playlist-read-private playlist-modify-public playlist-modify-private"
     params = {
         'client_id': settings.spotify_client_id,
         'response_type': 'code',
@@ -70,18 +187,15 @@ def get_auth_url():
     return f"{SPOTIFY_AUTH_URL}?{urllib.parse.urlencode(params)}"
 
 async def exchange_code_for_token(code: str):
-    auth_header = base64.b64encode(f"{settings.spotify_client_id}:{settings.spotify_client_secret}".encode()).decode()
-    logger.info(f"Exchanging code for token with redirect_uri: {settings.spotify_redirect_uri}")
-    async with httpx.AsyncClient() as http_client:
-        response = await http_client.post(
-            SPOTIFY_TOKEN_URL,
-            headers={'Authorization': f'Basic {auth_header}', 'Content-Type': 'application/x-www-form-urlencoded'},
-            data={'grant_type': 'authorization_code', 'code': code, 'redirect_uri': settings.spotify_redirect_uri}
-        )
-        if response.status_code != 200:
-            error_detail = response.text
-            logger.error(f"Spotify token exchange failed: {response.status_code} - {error_detail}")
-            raise HTTPException(status_code=400, detail=f"Failed to exchange code for token: {error_detail}")
-        data = response.json()
-        await store_tokens(data['access_token'], data['refresh_token'], data['expires_in'])
+    logger.info("Exchanging code for token with redirect_uri: %s", settings.spotify_redirect_uri)
+    response = await accounts_client.post(
+        SPOTIFY_TOKEN_URL,
+        data={'grant_type': 'authorization_code', 'code': code, 'redirect_uri': settings.spotify_redirect_uri}
+    )
+    if response.status_code != 200:
+        error_detail = response.text
+        logger.error("Spotify token exchange failed: %s - %s", response.status_code, error_detail)
+        raise HTTPException(status_code=400, detail=f"Failed to exchange code for token: {error_detail}")
+    data = orjson.loads(response.content)
+    await store_tokens(data['access_token'], data['refresh_token'], data['expires_in'])
 
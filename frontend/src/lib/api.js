@@ -9,9 +9,9 @@ const api = axios.create({
 
 export const endpoints = {
   checkAuth: "/spotify/status",
-  getPlaylistInfo: "/spotify/playlist-info",
   getNowPlaying: "/spotify/now-playing",
   getQueue: "/spotify/queue",
+  getDashboard: "/spotify/dashboard",
   search: "/spotify/search",
   addTrack: "/spotify/add-track",
   auth: "/spotify/auth",
@@ -32,17 +32,19 @@ const GuestPage = () => {
         checkAuth();
     }, []);
 
-    // Fetch playlist info
+    // Initial load: playlist info, now playing and queue in one request
     useEffect(() => {
-        const fetchPlaylistInfo = async () => {
+        const fetchDashboard = async () => {
             try {
-                const response = await api.get(endpoints.getPlaylistInfo);
-                setPlaylistInfo(response.data);
+                const response = await api.get(endpoints.getDashboard);
+                setPlaylistInfo(response.data.playlist_info);
+                setNowPlaying(response.data.now_playing);
+                setQueue(response.data.queue || []);
             } catch (e) {
-                console.error("Error fetching playlist info:", e);
+                console.error("Error fetching dashboard:", e);
             }
         };
-        if (isAuthenticated) fetchPlaylistInfo();
+        if (isAuthenticated) fetchDashboard();
     }, [isAuthenticated]);
 
     // Fetch now playing every 2 seconds
@@ -55,8 +57,8 @@ const GuestPage = () => {
                 console.error("Error fetching now playing:", e);
             }
         };
+        // The dashboard covers the first load; polling takes over from there
         if (isAuthenticated) {
-            fetchNowPlaying();
             const interval = setInterval(fetchNowPlaying, 2000);
             return () => clearInterval(interval);
         }
@@ -73,7 +75,6 @@ const GuestPage = () => {
             }
         };
         if (isAuthenticated) {
-            fetchQueue();
             const interval = setInterval(fetchQueue, 3000);
             return () => clearInterval(interval);
         }
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+# Settings are read when app.database is imported; nothing here connects to them
+for name in ('MONGO_URL', 'DB_NAME', 'SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET', 'SPOTIFY_REDIRECT_URI', 'SPOTIFY_PLAYLIST_ID'):
+    os.environ.setdefault(name, 'test')
+
+from app import batching
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class FakeCollection:
+    def __init__(self, docs, error=None):
+        self.docs = docs
+        self.error = error
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append((query, projection))
+        if self.error:
+            raise self.error
+        (field, cond), = query.items()
+        return FakeCursor(doc for doc in self.docs if doc[field] in cond['$in'])
+
+
+class FakeDatabase:
+    def __init__(self, collections):
+        self.collections = collections
+
+    def get_db(self):
+        return self.collections
+
+
+class BatcherTests(unittest.IsolatedAsyncioTestCase):
+    def use_collection(self, collection):
+        patcher = patch.object(batching, 'db', FakeDatabase({'things': collection}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return batching.Batcher('things', 'key', {'_id': 0}, delay=0.001)
+
+    async def test_concurrent_loads_share_one_query(self):
+        collection = FakeCollection([{'key': 'a', 'v': 1}, {'key': 'b', 'v': 2}])
+        batcher = self.use_collection(collection)
+        a, b, missing, a_again = await asyncio.gather(
+            batcher.load('a'), batcher.load('b'), batcher.load('c'), batcher.load('a')
+        )
+        self.assertEqual(len(collection.queries), 1)
+        query, projection = collection.queries[0]
+        self.assertEqual(sorted(query['key']['$in']), ['a', 'b', 'c'])
+        self.assertEqual(projection, {'_id': 0})
+        # Results are split back out per key; repeated keys get the same doc
+        self.assertEqual(a, {'key': 'a', 'v': 1})
+        self.assertEqual(b, {'key': 'b', 'v': 2})
+        self.assertIsNone(missing)
+        self.assertIs(a_again, a)
+
+    async def test_loads_after_a_flush_start_a_new_batch(self):
+        collection = FakeCollection([{'key': 'a'}])
+        batcher = self.use_collection(collection)
+        await batcher.load('a')
+        await batcher.load('a')
+        self.assertEqual(len(collection.queries), 2)
+
+    async def test_query_error_reaches_every_caller(self):
+        collection = FakeCollection([], error=RuntimeError('mongo down'))
+        batcher = self.use_collection(collection)
+        results = await asyncio.gather(batcher.load('a'), batcher.load('b'), return_exceptions=True)
+        self.assertEqual([str(result) for result in results], ['mongo down', 'mongo down'])
+        # The failed batch is forgotten; the next load queries again
+        collection.error = None
+        self.assertIsNone(await batcher.load('a'))
+        self.assertEqual(len(collection.queries), 2)
+
+    async def test_cancelled_caller_does_not_affect_the_rest_of_the_batch(self):
+        collection = FakeCollection([{'key': 'a'}, {'key': 'b'}])
+        batcher = self.use_collection(collection)
+        cancelled = asyncio.create_task(batcher.load('a'))
+        kept = asyncio.create_task(batcher.load('b'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        self.assertEqual(await kept, {'key': 'b'})
+        self.assertTrue(cancelled.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+from app import cache
+
+
+class AsyncTTLCacheTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Only the cache's clock is faked; the event loop keeps the real one
+        self.now = 1000.0
+        patcher = patch.object(cache, 'time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def make_cached(self, ttl=10, maxsize=1024, gate=None, fail=False):
+        @cache.AsyncTTLCache(ttl=ttl, maxsize=maxsize)
+        async def fetch(key):
+            self.calls.append(key)
+            if gate is not None:
+                await gate.wait()
+            if fail:
+                raise RuntimeError(key)
+            return {'key': key, 'call': len(self.calls)}
+        return fetch
+
+    async def test_concurrent_misses_share_one_call(self):
+        gate = asyncio.Event()
+        fetch = self.make_cached(gate=gate)
+        tasks = [asyncio.create_task(fetch('a')) for _ in range(5)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*tasks)
+        self.assertEqual(self.calls, ['a'])
+        self.assertTrue(all(result is results[0] for result in results))
+
+    async def test_hit_within_ttl_then_expiry(self):
+        fetch = self.make_cached(ttl=10)
+        first = await fetch('a')
+        self.now += 9
+        self.assertIs(await fetch('a'), first)
+        self.now += 2
+        self.assertIsNot(await fetch('a'), first)
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    async def test_kwargs_are_part_of_the_key(self):
+        @cache.AsyncTTLCache(ttl=10)
+        async def fetch(key, *, limit=1, offset=0):
+            self.calls.append((key, limit, offset))
+            return len(self.calls)
+
+        self.assertEqual(await fetch('a', limit=2, offset=3), 1)
+        self.assertEqual(await fetch('a', offset=3, limit=2), 1)
+        self.assertEqual(await fetch('a', limit=3, offset=3), 2)
+        self.assertEqual(await fetch('a'), 3)
+
+    async def test_lru_eviction(self):
+        fetch = self.make_cached(maxsize=2)
+        await fetch('a')
+        await fetch('b')
+        # Touch 'a' so 'b' becomes the least recently used
+        await fetch('a')
+        await fetch('c')
+        await fetch('a')
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        await fetch('b')
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+
+    async def test_errors_are_not_cached(self):
+        fetch = self.make_cached(fail=True)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                await fetch('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    async def test_error_reaches_every_waiter(self):
+        gate = asyncio.Event()
+        fetch = self.make_cached(gate=gate, fail=True)
+        tasks = [asyncio.create_task(fetch('a')) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(self.calls, ['a'])
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+    async def test_clear_while_in_flight_does_not_store_stale_result(self):
+        gate = asyncio.Event()
+        fetch = self.make_cached(gate=gate)
+        task = asyncio.create_task(fetch('a'))
+        await asyncio.sleep(0)
+        fetch.cache_clear()
+        gate.set()
+        await task
+        await fetch('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    async def test_cancelled_waiter_leaves_shared_call_running(self):
+        gate = asyncio.Event()
+        fetch = self.make_cached(gate=gate)
+        owner = asyncio.create_task(fetch('a'))
+        waiter = asyncio.create_task(fetch('a'))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        self.assertEqual((await owner)['key'], 'a')
+        self.assertTrue(waiter.cancelled())
+        self.assertEqual(self.calls, ['a'])
+
+    async def test_cancelled_owner_does_not_cancel_waiters(self):
+        gate = asyncio.Event()
+        fetch = self.make_cached(gate=gate)
+        owner = asyncio.create_task(fetch('a'))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(fetch('a')) for _ in range(2)]
+        await asyncio.sleep(0)
+        owner.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*waiters)
+        self.assertTrue(owner.cancelled())
+        # One waiter re-runs the call and the other joins it
+        self.assertEqual(self.calls, ['a', 'a'])
+        self.assertIs(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()